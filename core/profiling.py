@@ -0,0 +1,275 @@
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.urls import reverse
+
+# Phase used for samples taken outside any explicit profile_phase() block.
+DEFAULT_PHASE = "request"
+
+# Distinct stacks beyond this limit are folded into a single overflow bucket
+# so a long-running worker cannot grow the aggregate without bound.
+MAX_STACKS = 10000
+MAX_DEPTH = 128
+OVERFLOW_STACK = "[truncated]"
+
+# Thread id -> (root frame, current phase) for every request being profiled.
+# Written by request threads, read by the sampler thread.
+_active = {}
+_stacks = Counter()
+_lock = threading.Lock()
+_sampler = None
+
+# Snapshots taken for the dump file are numbered under _lock. Writes are
+# serialized under _flush_lock and an older snapshot never replaces a newer
+# one, even when an exiting sampler and its successor flush at the same time.
+_flush_lock = threading.Lock()
+_snapshot_count = 0
+_flushed_snapshot = 0
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_enabled():
+    return _setting("TALLY_PROFILING_ENABLED", False)
+
+
+class profile_phase:
+    """
+    Tags samples taken inside the block with the given phase name
+    (e.g. "validation", "xml_build", "tally_io", "parse").
+    Does nothing unless the current request is being profiled.
+    """
+    __slots__ = ("phase", "previous", "thread_id")
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.previous = None
+        self.thread_id = None
+
+    def __enter__(self):
+        thread_id = threading.get_ident()
+        entry = _active.get(thread_id)
+        if entry is not None:
+            self.thread_id = thread_id
+            self.previous = entry[1]
+            _active[thread_id] = (entry[0], self.phase)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.thread_id is not None:
+            entry = _active.get(self.thread_id)
+            if entry is not None:
+                _active[self.thread_id] = (entry[0], self.previous)
+        return False
+
+
+class _Sampler(threading.Thread):
+    """
+    Background thread that periodically snapshots the stacks of all
+    profiled request threads and aggregates them in collapsed form.
+    Flushes the aggregate to disk every flush_interval seconds and once
+    more when it exits, which happens as soon as no request is profiled.
+    """
+    def __init__(self, interval, output, flush_interval):
+        super().__init__(name="tally-profiler", daemon=True)
+        self.interval = interval
+        self.output = output
+        self.flush_interval = flush_interval
+        self.wakeup = threading.Event()
+
+    def run(self):
+        global _sampler
+        last_flush = time.monotonic()
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            now = time.monotonic()
+            snapshot = None
+            with _lock:
+                exiting = not _active
+                if not exiting:
+                    self._sample()
+                if self.output and (exiting or now - last_flush >= self.flush_interval):
+                    snapshot = _snapshot()
+                if exiting:
+                    _sampler = None
+
+            if snapshot is not None:
+                self._flush(*snapshot)
+                last_flush = now
+            if exiting:
+                return
+
+    def _flush(self, number, stacks):
+        global _flushed_snapshot
+        with _flush_lock:
+            if number < _flushed_snapshot:
+                return
+            try:
+                write_output(self.output, stacks)
+            except OSError as e:
+                print(f"Error: Could not write profiling output: {e}")
+                return
+            _flushed_snapshot = number
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for thread_id, (root, phase) in list(_active.items()):
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and frame is not root and len(names) < MAX_DEPTH:
+                code = frame.f_code
+                module = frame.f_globals.get("__name__", "?")
+                names.append(f"{module}:{code.co_name}")
+                frame = frame.f_back
+            names.append(phase)
+            _record(";".join(reversed(names)))
+
+
+def _record(stack):
+    """
+    Counts one sample of the given collapsed stack. Must hold _lock.
+    """
+    if stack not in _stacks and len(_stacks) >= MAX_STACKS:
+        stack = OVERFLOW_STACK
+    _stacks[stack] += 1
+
+
+def start(root_frame):
+    """
+    Starts profiling the calling thread. Frames at or above root_frame
+    (server and middleware plumbing) are left out of the recorded stacks.
+    """
+    global _sampler
+    interval = _setting("TALLY_PROFILING_INTERVAL", 0.005)
+    flush_interval = _setting("TALLY_PROFILING_FLUSH_INTERVAL", 10.0)
+    with _lock:
+        _active[threading.get_ident()] = (root_frame, DEFAULT_PHASE)
+        if _sampler is None:
+            _sampler = _Sampler(interval, output_path(), flush_interval)
+            _sampler.start()
+
+
+def stop():
+    """
+    Stops profiling the calling thread.
+    """
+    with _lock:
+        _active.pop(threading.get_ident(), None)
+        if not _active and _sampler is not None:
+            _sampler.wakeup.set()
+
+
+def _collapse(items):
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(items))
+
+
+def _snapshot():
+    """
+    Returns (number, collapsed stacks) for the dump file. Must hold _lock.
+    """
+    global _snapshot_count
+    _snapshot_count += 1
+    return _snapshot_count, _collapse(_stacks.items())
+
+
+def collapsed_stacks():
+    """
+    Returns the aggregated samples in the collapsed "frame;frame;frame count"
+    format understood by flamegraph.pl, speedscope and similar tools.
+    """
+    with _lock:
+        items = list(_stacks.items())
+    return _collapse(items)
+
+
+def reset():
+    """
+    Discards all aggregated samples.
+    """
+    with _lock:
+        _stacks.clear()
+
+
+def output_path():
+    """
+    Returns the file this process dumps its stacks to, or None if
+    TALLY_PROFILING_OUTPUT is not set. Samples are aggregated per process,
+    so the process id is added to the name: "stacks.txt" becomes
+    "stacks.<pid>.txt" and each worker writes its own file.
+    """
+    path = _setting("TALLY_PROFILING_OUTPUT", None)
+    if not path:
+        return None
+    root, ext = os.path.splitext(os.fspath(path))
+    return f"{root}.{os.getpid()}{ext}"
+
+
+def write_output(path, stacks):
+    """
+    Writes collapsed stacks to path. The dump goes to a uniquely named
+    temporary file in the same directory first and is then renamed over
+    path, so readers never see a partial dump.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or None, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(stacks)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class TallyProfilingMiddleware:
+    """
+    Samples stacks for a fraction of requests under TALLY_PROFILING_PATH_PREFIX.
+    A request is profiled when TALLY_PROFILING_ENABLED is on and either it is
+    picked at TALLY_PROFILING_SAMPLE_RATE or a staff user sends the
+    TALLY_PROFILING_HEADER header with the value "1"; any other value is
+    ignored. The staff check uses the Django session
+    user, so it must be placed after AuthenticationMiddleware. The profiling
+    endpoint itself is never profiled.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self._should_profile(request):
+            return self.get_response(request)
+
+        start(sys._getframe())
+        try:
+            return self.get_response(request)
+        finally:
+            stop()
+
+    def _should_profile(self, request):
+        if not is_enabled():
+            return False
+
+        prefix = _setting("TALLY_PROFILING_PATH_PREFIX", "/api/")
+        if not request.path.startswith(prefix):
+            return False
+        if request.path == reverse("profiling-stacks"):
+            return False
+
+        header = _setting("TALLY_PROFILING_HEADER", "X-Tally-Profile")
+        if request.headers.get(header) == "1":
+            user = getattr(request, "user", None)
+            if user is not None and user.is_active and user.is_staff:
+                return True
+
+        sample_rate = _setting("TALLY_PROFILING_SAMPLE_RATE", 0.0)
+        return sample_rate > 0 and random.random() < sample_rate
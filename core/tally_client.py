@@ -2,6 +2,15 @@ from datetime import datetime, date
 import requests
 import xmltodict
 import json
+from contextlib import nullcontext
+
+try:
+    from .profiling import profile_phase
+except ImportError:
+    # Running this file directly (see __main__ below) has no package or Django
+    # settings, so phases are not tagged.
+    def profile_phase(phase):
+        return nullcontext()
 
 class TallyClient:
     """
@@ -17,12 +26,14 @@ class TallyClient:
         """
         headers = {'Content-Type': 'application/xml'}
         try:
-            response = requests.post(self.TALLY_URL, data=xml_request, headers=headers)
-            response.raise_for_status()
+            with profile_phase("tally_io"):
+                response = requests.post(self.TALLY_URL, data=xml_request, headers=headers)
+                response.raise_for_status()
             # Tally can return a single string in some error cases, handle that here.
-            if response.text.startswith("<"):
-                return xmltodict.parse(response.content)
-            return {"RESPONSE": response.text}
+            with profile_phase("parse"):
+                if response.text.startswith("<"):
+                    return xmltodict.parse(response.content)
+                return {"RESPONSE": response.text}
 
         except requests.exceptions.RequestException as e:
             print(f"Error: Could not connect to TallyPrime at {self.TALLY_URL}. Is the application running?")
@@ -120,6 +131,14 @@ class TallyVoucher(TallyClient):
         """
         Creates one or more Vouchers in TallyPrime based on the provided list of data.
         """
+        with profile_phase("xml_build"):
+            xml_request = self._build_vouchers_xml(vouchers_data)
+        return self._send_request_to_tally(xml_request)
+
+    def _build_vouchers_xml(self, vouchers_data):
+        """
+        Builds the Import Data XML request for the provided list of vouchers.
+        """
         all_vouchers_xml = ""
         for voucher_data in vouchers_data:
             voucher_date = voucher_data.get('date')
@@ -178,7 +197,7 @@ class TallyVoucher(TallyClient):
         </BODY>
     </ENVELOPE>"""
 
-        return self._send_request_to_tally(xml_request)
+        return xml_request
 
 if __name__ == "__main__":
     client = TallyClient()
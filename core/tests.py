@@ -1,3 +1,268 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from . import profiling
+from .profiling import TallyProfilingMiddleware, profile_phase
+
+
+@override_settings(TALLY_PROFILING_ENABLED=True, TALLY_PROFILING_SAMPLE_RATE=0.0)
+class ShouldProfileTests(TestCase):
+    """
+    Tests for the request gating in TallyProfilingMiddleware.
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = TallyProfilingMiddleware(lambda request: None)
+        self.staff = User.objects.create_user("staff", is_staff=True)
+        self.user = User.objects.create_user("user")
+
+    def _request(self, path="/api/vouchers/create/", user=None, header=False):
+        if header is True:
+            header = "1"
+        headers = {"X-Tally-Profile": header} if header else {}
+        request = self.factory.post(path, headers=headers)
+        request.user = user if user is not None else AnonymousUser()
+        return request
+
+    def test_disabled(self):
+        request = self._request(user=self.staff, header=True)
+        with override_settings(TALLY_PROFILING_ENABLED=False, TALLY_PROFILING_SAMPLE_RATE=1.0):
+            self.assertFalse(self.middleware._should_profile(request))
+
+    def test_path_outside_prefix(self):
+        request = self._request("/admin/", user=self.staff, header=True)
+        self.assertFalse(self.middleware._should_profile(request))
+
+    def test_profiling_endpoint_is_excluded(self):
+        request = self._request(reverse("profiling-stacks"), user=self.staff, header=True)
+        with override_settings(TALLY_PROFILING_SAMPLE_RATE=1.0):
+            self.assertFalse(self.middleware._should_profile(request))
+
+    def test_header_from_non_staff_user(self):
+        request = self._request(user=self.user, header=True)
+        self.assertFalse(self.middleware._should_profile(request))
+
+    def test_header_from_anonymous_user(self):
+        request = self._request(header=True)
+        self.assertFalse(self.middleware._should_profile(request))
+
+    def test_header_from_staff_user(self):
+        request = self._request(user=self.staff, header=True)
+        self.assertTrue(self.middleware._should_profile(request))
+
+    def test_header_from_staff_user_with_other_value(self):
+        for value in ["0", "false", "yes"]:
+            request = self._request(user=self.staff, header=value)
+            self.assertFalse(self.middleware._should_profile(request), value)
+
+    def test_staff_user_without_header(self):
+        request = self._request(user=self.staff)
+        self.assertFalse(self.middleware._should_profile(request))
+
+    def test_sample_rate(self):
+        request = self._request()
+        with override_settings(TALLY_PROFILING_SAMPLE_RATE=0.0):
+            self.assertFalse(self.middleware._should_profile(request))
+        with override_settings(TALLY_PROFILING_SAMPLE_RATE=1.0):
+            self.assertTrue(self.middleware._should_profile(request))
+
+
+class ProfilePhaseTests(TestCase):
+    """
+    Tests for phase tagging with profile_phase.
+    """
+    def setUp(self):
+        # Register the thread directly so no sampler thread is started.
+        self.thread_id = threading.get_ident()
+        profiling._active[self.thread_id] = (None, profiling.DEFAULT_PHASE)
+
+    def tearDown(self):
+        profiling._active.pop(self.thread_id, None)
+
+    def _phase(self):
+        return profiling._active[self.thread_id][1]
+
+    def test_restores_previous_phase(self):
+        with profile_phase("xml_build"):
+            self.assertEqual(self._phase(), "xml_build")
+            with profile_phase("tally_io"):
+                self.assertEqual(self._phase(), "tally_io")
+            self.assertEqual(self._phase(), "xml_build")
+        self.assertEqual(self._phase(), profiling.DEFAULT_PHASE)
+
+    def test_restores_previous_phase_on_exception(self):
+        with self.assertRaises(ValueError):
+            with profile_phase("parse"):
+                raise ValueError("bad response")
+        self.assertEqual(self._phase(), profiling.DEFAULT_PHASE)
+
+    def test_noop_for_unprofiled_thread(self):
+        profiling._active.pop(self.thread_id)
+        with profile_phase("validation"):
+            self.assertNotIn(self.thread_id, profiling._active)
+        self.assertNotIn(self.thread_id, profiling._active)
+
+
+class StackAggregationTests(TestCase):
+    """
+    Tests for the collapsed stack aggregate.
+    """
+    def setUp(self):
+        profiling.reset()
+
+    def tearDown(self):
+        profiling.reset()
+
+    @mock.patch.object(profiling, "MAX_STACKS", 2)
+    def test_overflow_bucket(self):
+        with profiling._lock:
+            for stack in ["request;a", "request;b", "request;c", "request;a", "request;d"]:
+                profiling._record(stack)
+        self.assertEqual(
+            profiling.collapsed_stacks(),
+            f"{profiling.OVERFLOW_STACK} 2\nrequest;a 2\nrequest;b 1\n",
+        )
+
+
+class ProfiledRequestTests(TestCase):
+    """
+    Tests that run a request through TallyProfilingMiddleware and the sampler.
+    """
+    def setUp(self):
+        profiling.reset()
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.sampler = None
+
+    def tearDown(self):
+        profiling.reset()
+        self.output_dir.cleanup()
+
+    def _slow_tally_post(self, *args, **kwargs):
+        self.sampler = profiling._sampler
+        time.sleep(0.1)
+        return mock.Mock(text="Unknown Request")
+
+    def test_samples_are_tagged_by_phase(self):
+        vouchers = [{
+            "date": "20250913",
+            "voucher_type": "Payment",
+            "voucher_number": "PMT-001",
+            "ledger_entries": [{"ledger_name": "Cash", "amount": "500.00"}],
+        }]
+        output = os.path.join(self.output_dir.name, "stacks.txt")
+        with override_settings(
+            TALLY_PROFILING_ENABLED=True,
+            TALLY_PROFILING_SAMPLE_RATE=1.0,
+            TALLY_PROFILING_INTERVAL=0.001,
+            TALLY_PROFILING_OUTPUT=output,
+        ), mock.patch("core.tally_client.requests.post", side_effect=self._slow_tally_post):
+            self.client.post(reverse("create-voucher"), vouchers, content_type="application/json")
+
+        self.assertIsNotNone(self.sampler)
+        self.sampler.join(timeout=5)
+        self.assertFalse(self.sampler.is_alive())
+
+        stacks = profiling.collapsed_stacks()
+        tally_io = [line for line in stacks.splitlines() if line.startswith("tally_io;")]
+        self.assertTrue(tally_io, stacks)
+        self.assertTrue(any("core.tally_client:_send_request_to_tally" in line for line in tally_io))
+        for line in stacks.splitlines():
+            frames = line.rsplit(" ", 1)[0].split(";")
+            for frame in frames:
+                self.assertFalse(frame.startswith("core.profiling:"), line)
+                self.assertFalse(frame.startswith("django.test.client:"), line)
+                self.assertNotEqual(frame, "django.core.handlers.base:get_response", line)
+
+        with open(f"{os.path.splitext(output)[0]}.{os.getpid()}.txt") as f:
+            self.assertEqual(f.read(), stacks)
+
+
+class OutputTests(TestCase):
+    """
+    Tests for writing the stacks to disk.
+    """
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.output_dir.cleanup()
+
+    def test_output_path_includes_pid(self):
+        with override_settings(TALLY_PROFILING_OUTPUT="/var/tmp/stacks.txt"):
+            self.assertEqual(profiling.output_path(), f"/var/tmp/stacks.{os.getpid()}.txt")
+        with override_settings(TALLY_PROFILING_OUTPUT=None):
+            self.assertIsNone(profiling.output_path())
+
+    def test_write_output(self):
+        path = os.path.join(self.output_dir.name, "stacks.txt")
+        profiling.write_output(path, "request;a 1\n")
+        with open(path) as f:
+            self.assertEqual(f.read(), "request;a 1\n")
+        self.assertEqual(os.listdir(self.output_dir.name), ["stacks.txt"])
+
+    def test_write_output_removes_temp_file_on_error(self):
+        path = os.path.join(self.output_dir.name, "stacks.txt")
+        with mock.patch.object(profiling.os, "replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                profiling.write_output(path, "request;a 1\n")
+        self.assertEqual(os.listdir(self.output_dir.name), [])
+
+    def test_older_snapshot_is_not_flushed(self):
+        path = os.path.join(self.output_dir.name, "stacks.txt")
+        sampler = profiling._Sampler(0.001, path, 10.0)
+        with mock.patch.object(profiling, "_flushed_snapshot", 0):
+            sampler._flush(2, "request;new 1\n")
+            sampler._flush(1, "request;old 1\n")
+        with open(path) as f:
+            self.assertEqual(f.read(), "request;new 1\n")
+
+
+@override_settings(TALLY_PROFILING_ENABLED=True)
+class ProfileStacksViewTests(TestCase):
+    """
+    Tests for the api/profiling/stacks/ endpoint.
+    """
+    def setUp(self):
+        self.url = reverse("profiling-stacks")
+        self.staff = User.objects.create_user("staff", is_staff=True)
+        self.user = User.objects.create_user("user")
+        profiling.reset()
+        with profiling._lock:
+            profiling._record("request;core.views:post")
+
+    def tearDown(self):
+        profiling.reset()
+
+    def test_disabled(self):
+        self.client.force_login(self.staff)
+        with override_settings(TALLY_PROFILING_ENABLED=False):
+            self.assertEqual(self.client.get(self.url).status_code, 404)
+            self.assertEqual(self.client.delete(self.url).status_code, 404)
+
+    def test_non_staff_user(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.client.delete(self.url).status_code, 403)
+
+    def test_anonymous_user(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_get(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertEqual(response.content.decode(), "request;core.views:post 1\n")
+
+    def test_delete(self):
+        self.client.force_login(self.staff)
+        response = self.client.delete(self.url)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(profiling.collapsed_stacks(), "")
@@ -1,9 +1,10 @@
 from django.urls import path
-from .views import CreateGroupView, DeleteGroupView, CreateLedgerView, CreateVoucherView
+from .views import CreateGroupView, DeleteGroupView, CreateLedgerView, CreateVoucherView, ProfileStacksView
 
 urlpatterns = [
     path('groups/create/', CreateGroupView.as_view(), name='create-group'),
     path('groups/delete/', DeleteGroupView.as_view(), name='delete-group'),
     path('ledgers/create/', CreateLedgerView.as_view(), name='create-ledger'),
     path('vouchers/create/', CreateVoucherView.as_view(), name='create-voucher'),
+    path('profiling/stacks/', ProfileStacksView.as_view(), name='profiling-stacks'),
 ]
\ No newline at end of file
@@ -1,6 +1,11 @@
+from django.http import Http404, HttpResponse
 from rest_framework import status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from . import profiling
+from .profiling import profile_phase
 from .tally_client import TallyMaster, TallyVoucher
 from .serializers import GroupSerializer, DeleteGroupSerializer, LedgerSerializer, VoucherSerializer
 
@@ -14,7 +19,9 @@ class CreateGroupView(APIView):
     """
     def post(self, request):
         serializer = GroupSerializer(data=request.data)
-        if serializer.is_valid():
+        with profile_phase("validation"):
+            is_valid = serializer.is_valid()
+        if is_valid:
             group_name = serializer.validated_data['group_name']
             parent_group = serializer.validated_data['parent_group']
             
@@ -53,7 +60,9 @@ class DeleteGroupView(APIView):
     """
     def delete(self, request):
         serializer = DeleteGroupSerializer(data=request.data)
-        if serializer.is_valid():
+        with profile_phase("validation"):
+            is_valid = serializer.is_valid()
+        if is_valid:
             group_name = serializer.validated_data['group_name']
             
             try:
@@ -93,7 +102,9 @@ class CreateLedgerView(APIView):
     """
     def post(self, request):
         serializer = LedgerSerializer(data=request.data)
-        if serializer.is_valid():
+        with profile_phase("validation"):
+            is_valid = serializer.is_valid()
+        if is_valid:
             ledger_name = serializer.validated_data['ledger_name']
             parent_group = serializer.validated_data['parent_group']
             opening_balance = serializer.validated_data.get('opening_balance', 0)
@@ -134,7 +145,9 @@ class CreateVoucherView(APIView):
         # We expect a list of vouchers, so many=True is needed
         serializer = VoucherSerializer(data=request.data, many=True)
         
-        if serializer.is_valid():
+        with profile_phase("validation"):
+            is_valid = serializer.is_valid()
+        if is_valid:
             vouchers_data = serializer.validated_data
             
             try:
@@ -179,4 +192,27 @@ class CreateVoucherView(APIView):
                     "details": str(e)
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class ProfileStacksView(APIView):
+    """
+    API endpoint to fetch or reset the aggregated profiling samples.
+    GET returns flame-graph-compatible collapsed stacks, DELETE clears them.
+    Samples are aggregated per process, so with several workers each call
+    only sees the worker that served it; use TALLY_PROFILING_OUTPUT to get
+    one file per worker instead. Uses session authentication, the same as
+    the X-Tally-Profile header check in TallyProfilingMiddleware.
+    """
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        if not profiling.is_enabled():
+            raise Http404
+        return HttpResponse(profiling.collapsed_stacks(), content_type="text/plain; charset=utf-8")
+
+    def delete(self, request):
+        if not profiling.is_enabled():
+            raise Http404
+        profiling.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
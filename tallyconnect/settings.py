@@ -47,6 +47,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'core.profiling.TallyProfilingMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -121,3 +122,21 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Sampling profiler for the Tally API endpoints. Off by default.
+# Profiled requests are picked at TALLY_PROFILING_SAMPLE_RATE, or forced by a
+# staff user (logged in through the session) sending the TALLY_PROFILING_HEADER
+# header with the value 1. Stacks are aggregated per process and served from
+# api/profiling/stacks/ (staff only). If TALLY_PROFILING_OUTPUT is set, each
+# process also writes them in flame-graph collapsed format to that path with
+# its pid added (e.g. stacks.1234.txt), every TALLY_PROFILING_FLUSH_INTERVAL
+# seconds and when profiling goes idle.
+
+TALLY_PROFILING_ENABLED = False
+TALLY_PROFILING_SAMPLE_RATE = 0.0
+TALLY_PROFILING_HEADER = 'X-Tally-Profile'
+TALLY_PROFILING_PATH_PREFIX = '/api/'
+TALLY_PROFILING_INTERVAL = 0.005
+TALLY_PROFILING_OUTPUT = None
+TALLY_PROFILING_FLUSH_INTERVAL = 10.0